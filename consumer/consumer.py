@@ -1,19 +1,186 @@
 """This script is a consumer that listens to the queue and processes the messages and pushes them to the InfluxDB database."""
 
 import argparse
+import ctypes
 import os
+import socket
+import struct
 import sys
+import threading
 import time
-from multiprocessing import Manager, Process
+from functools import lru_cache, partial
+from multiprocessing import Lock, Process
+from multiprocessing.shared_memory import SharedMemory
+from urllib.parse import urlparse
 
 import yaml
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
 from kombu import Connection, Consumer, Exchange, Queue
+from kombu.serialization import register
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import librabbitmq
+except ImportError:
+    librabbitmq = None
+
+# Use the libyaml based loader when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def register_orjson_serializer() -> str:
+    """
+    Register orjson as a kombu serializer and return the serializer name to use, falling back to json if orjson is not installed.
+    """
+    if orjson is None:
+        return "json"
+    register("ojson", orjson.dumps, orjson.loads, content_type="application/json", content_encoding="binary")
+    return "ojson"
+
+
+SERIALIZER = register_orjson_serializer()
+
+
+class SharedRingBuffer:
+    """
+    Single-producer / single-consumer ring buffer living in shared memory.
+
+    The header keeps the ``head`` (consumer) and ``tail`` (producer) counters on separate
+    64-byte cache lines. Each slot stores a 4-byte length prefix followed by the payload.
+    Only the producer writes ``tail`` and only the consumer writes ``head``, and each consumer
+    process gets its own buffer. The counters are read and published under a shared lock that
+    serves as a memory barrier: the payload is copied outside of it, but a new ``tail`` only becomes
+    visible after the slot is written and a new ``head`` only after the slot is read. Plain stores
+    alone would only be ordered on x86; the lock keeps the handoff correct on aarch64 as well.
+    Pass the multiprocessing context used to start the processes if it is not the default one.
+    """
+
+    HEADER_SIZE = 128
+    LENGTH_PREFIX = struct.Struct("<I")
+
+    def __init__(self, slots: int = 1024, slot_size: int = 4096, name: str = None, fence=None, context=None) -> None:
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_payload = slot_size - self.LENGTH_PREFIX.size
+        if name is None:
+            self.shm = SharedMemory(create=True, size=self.HEADER_SIZE + slots * slot_size)
+            self.shm.buf[:self.HEADER_SIZE] = bytes(self.HEADER_SIZE)
+        else:
+            self.shm = SharedMemory(name=name)
+        if fence is None:
+            fence = context.Lock() if context is not None else Lock()
+        self.fence = fence
+        self._head = ctypes.c_uint64.from_buffer(self.shm.buf, 0)
+        self._tail = ctypes.c_uint64.from_buffer(self.shm.buf, 64)
+
+    def __getstate__(self) -> tuple:
+        return self.slots, self.slot_size, self.shm.name, self.fence
+
+    def __setstate__(self, state: tuple) -> None:
+        self.__init__(*state)
+
+    def _slot_offset(self, index: int) -> int:
+        return self.HEADER_SIZE + (index % self.slots) * self.slot_size
+
+    def offer(self, payload: bytes) -> bool:
+        """
+        Copy the payload into the next free slot. Return False if it is too large or the buffer is full.
+        Must only be called by the single producer.
+        """
+        if len(payload) > self.max_payload:
+            return False
+        with self.fence:
+            tail = self._tail.value
+            head = self._head.value
+        if tail - head >= self.slots:
+            return False
+        offset = self._slot_offset(tail)
+        self.LENGTH_PREFIX.pack_into(self.shm.buf, offset, len(payload))
+        start = offset + self.LENGTH_PREFIX.size
+        self.shm.buf[start:start + len(payload)] = payload
+        # Publish the slot only once it is fully written
+        with self.fence:
+            self._tail.value = tail + 1
+        return True
+
+    def put(self, payload: bytes, timeout: float = None) -> None:
+        """
+        Offer the payload, backing off while the buffer is full. Raise ValueError if it can never fit.
+        """
+        if len(payload) > self.max_payload:
+            raise ValueError(f"Payload of {len(payload)} bytes exceeds the slot size of {self.max_payload} bytes.")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0001
+        while not self.offer(payload):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("Timed out waiting for free space in the ring buffer.")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+
+    def poll(self) -> bytes:
+        """
+        Return the oldest payload, or None if the buffer is empty. Must only be called by the single consumer.
+        """
+        with self.fence:
+            head = self._head.value
+            tail = self._tail.value
+        if head == tail:
+            return None
+        offset = self._slot_offset(head)
+        (length,) = self.LENGTH_PREFIX.unpack_from(self.shm.buf, offset)
+        start = offset + self.LENGTH_PREFIX.size
+        payload = bytes(self.shm.buf[start:start + length])
+        # Release the slot only once it is fully read
+        with self.fence:
+            self._head.value = head + 1
+        return payload
+
+    def close(self, unlink: bool = False) -> None:
+        """
+        Release the ctypes views and detach from (optionally unlink) the shared memory block.
+        """
+        del self._head, self._tail
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+# Empty payload put by each consumer process when it stops
+STATS_SENTINEL = b""
+
+# Two-byte vhost index prepended to every stats payload
+VHOST_INDEX = struct.Struct("<H")
+
+
+def encode_stats(vhost_idx: int, condor_metrics: str) -> bytes:
+    """
+    Encode a condor metrics line as a two-byte vhost index followed by the UTF-8 line. No line marks the vhost as unreachable.
+    """
+    if condor_metrics is None:
+        return VHOST_INDEX.pack(vhost_idx)
+    return VHOST_INDEX.pack(vhost_idx) + condor_metrics.encode("utf-8")
+
+
+def decode_stats(payload: bytes) -> tuple:
+    """
+    Decode a payload produced by encode_stats into a (vhost_idx, condor_metrics) tuple.
+    """
+    (vhost_idx,) = VHOST_INDEX.unpack_from(payload)
+    if len(payload) <= VHOST_INDEX.size:
+        return vhost_idx, None
+    return vhost_idx, payload[VHOST_INDEX.size:].decode("utf-8")
 
 
 def get_pulsar_runners(job_conf_file: str) -> dict:
     """
-    Parse the job_conf.yml file and extract the Pulsar runners and their AMQP URLs.
+    Parse the job_conf.yml file and extract the Pulsar runners with their AMQP URL,
+    vhost and the precomputed exchange, queue and routing key names.
+    Runners sharing an AMQP URL share the same queue, so only the first one is kept.
     """
     # Check the existence of the job_conf.yml file
     if not os.path.exists(job_conf_file):
@@ -21,13 +188,25 @@ def get_pulsar_runners(job_conf_file: str) -> dict:
         return None
 
     with open(job_conf_file, "r") as file:
-        job_conf = yaml.safe_load(file)
+        job_conf = yaml.load(file, Loader=YamlLoader)
 
     pulsar_runners = {}
+    seen_urls = {}
     for runner, values in job_conf["runners"].items():
-        if runner.startswith("pulsar"):
-            if "amqp_url" in values:
-                pulsar_runners[runner] = values["amqp_url"]
+        if runner.startswith("pulsar") and "amqp_url" in values:
+            amqp_url = values["amqp_url"]
+            if amqp_url in seen_urls:
+                print(f"Runner {runner} uses the same AMQP URL as {seen_urls[amqp_url]}, consuming its queue only once.")
+                continue
+            seen_urls[amqp_url] = runner
+            vhost = get_vhost_name(amqp_url)
+            pulsar_runners[runner] = {
+                "url": amqp_url,
+                "vhost": vhost,
+                "exchange": f"{vhost}-condor-exchange",
+                "queue": f"{vhost}-condor-stats",
+                "routing_key": f"{vhost}-condor",
+            }
 
     return pulsar_runners
 
@@ -36,14 +215,26 @@ def get_vhost_name(amqp_url: str) -> str:
     """
     Parse the AMQP URL to extract the vhost name.
     """
-    vhost = amqp_url.split("/")[-1].split("?")[0]
+    vhost = urlparse(amqp_url).path.lstrip("/")
     return vhost
 
 
+def get_condor_queue(exchange_name: str, queue_name: str, routing_key: str) -> Queue:
+    """
+    Build the condor stats queue bound to its direct exchange.
+    """
+    exchange = Exchange(exchange_name, type="direct")
+    return Queue(name=queue_name, exchange=exchange, routing_key=routing_key)
+
+
 def connect_to_queue(amqp_url: str) -> Connection:
     """
     Connect to the AMQP queue using the provided URL.
     """
+    # Use the C based librabbitmq transport for plain amqp:// URLs when it is installed
+    if librabbitmq is not None and amqp_url.startswith("amqp://"):
+        amqp_url = f"librabbitmq://{amqp_url[len('amqp://'):]}"
+
     # With try and except block, connect to the AMQP queue using the provided URL and manage the error if the connection fails
     try:
         connection = Connection(amqp_url)
@@ -54,39 +245,72 @@ def connect_to_queue(amqp_url: str) -> Connection:
         return None
 
 
-def process_message(body, message, vhost, stats_queue) -> None:
+def process_message(body, message, vhost_idx: int, stats_ring: SharedRingBuffer) -> None:
     """
-    Process the incoming message and push the data to the results list.
+    Process the incoming message and push the data to the shared stats ring buffer.
+    Batched messages are unrolled into one entry per condor metrics sample. Samples too large for
+    a ring buffer slot are skipped, and malformed messages are rejected, so every message is either
+    acked or rejected exactly once.
     """
     try:
-        stats_queue.put({vhost: body})
-        message.ack()
+        samples = body["batch"] if "batch" in body else [body["condor_metrics"]]
+        payloads = []
+        for condor_metrics in samples:
+            payload = encode_stats(vhost_idx, condor_metrics)
+            if len(payload) > stats_ring.max_payload:
+                print(f"Skipping condor metrics sample of {len(payload)} bytes, larger than the {stats_ring.max_payload} bytes stats slots.")
+            else:
+                payloads.append(payload)
     except Exception as e:
         print(f"Error processing message: {e}")
+        message.reject()
+        return
 
+    for payload in payloads:
+        stats_ring.put(payload)
+    message.ack()
 
 
-def consume_target(amqp_url: str, stats_queue) -> None:
+def consume_target(vhost_idx: int, runner: dict, stats_ring: SharedRingBuffer, idle_timeout: int, max_reconnect_interval: int = 30) -> None:
     """
     Define a target function for each process to consume messages and aggregate them.
+    The process blocks in the broker socket until a message arrives and only wakes up
+    on its own after idle_timeout seconds without traffic, which marks the vhost as idle.
+    Connection errors are not idleness: the process reconnects with an increasing delay,
+    up to max_reconnect_interval seconds, and consumes the same queue again.
     """
-    connection = connect_to_queue(amqp_url)
-
-    if connection.connected:
-        vhost = get_vhost_name(amqp_url)
-        routing_key = f"{vhost}-condor"
-        exchange = Exchange(f"{vhost}-condor-exchange", type="direct")
-        queue = Queue(name=f"{vhost}-condor-stats", exchange=exchange, routing_key=routing_key)
-
-        with Consumer(connection, queues=queue, callbacks=[lambda body, message: process_message(body, message, vhost, stats_queue)], accept=["json"]):
-            while True:
-                try:
-                    connection.drain_events(timeout=2)
-                except Exception as e:
-                    print(f"Error consuming messages: {e}")
-                    stats_queue.put({vhost: None})
-    else:
-        print(f"Failed to connect to the AMQP queue of {vhost}.")
+    try:
+        connection = connect_to_queue(runner["url"])
+        vhost = runner["vhost"]
+
+        if not (connection and connection.connected):
+            print(f"Failed to connect to the AMQP queue of {vhost}.")
+            return
+
+        queue = get_condor_queue(runner["exchange"], runner["queue"], runner["routing_key"])
+        reconnect_interval = 1
+        while True:
+            try:
+                connection.ensure_connection(max_retries=3)
+                with Consumer(connection, queues=queue, callbacks=[partial(process_message, vhost_idx=vhost_idx, stats_ring=stats_ring)], accept=[SERIALIZER, "json"]):
+                    reconnect_interval = 1
+                    while True:
+                        try:
+                            connection.drain_events(timeout=idle_timeout)
+                        except socket.timeout:
+                            stats_ring.offer(encode_stats(vhost_idx, None))
+            except Exception as e:
+                print(f"Error consuming messages from {vhost}, reconnecting in {reconnect_interval} seconds: {e}")
+
+            # Drop the broken connection and retry on a fresh one with the same parameters
+            connection.release()
+            time.sleep(reconnect_interval)
+            reconnect_interval = min(reconnect_interval * 2, max_reconnect_interval)
+            connection = connection.clone()
+    finally:
+        # Tell the drain thread that this consumer is done and detach from the shared memory
+        stats_ring.put(STATS_SENTINEL)
+        stats_ring.close()
 
 
 def get_influxdb_conf_from_env() -> tuple:
@@ -122,9 +346,10 @@ def influxdb_connect(host: str, port: int, username: str, password: str, databas
 def influxdb_get_last_entry(client: InfluxDBClient, measurement: str, destination_id: str) -> dict:
     """
     Fetch the last entry from the InfluxDB database for the given measurement and destination ID.
+    Return None if the destination has no entries yet.
     """
     result = client.query(f'SELECT * FROM "{measurement}" WHERE "destination_id"=\'{destination_id}\' ORDER BY time DESC LIMIT 1')
-    return list(result.get_points())[0]
+    return next(result.get_points(), None)
 
 
 def influxdb_get_measurement_metadata(client: InfluxDBClient, measurement: str) -> tuple:
@@ -184,26 +409,78 @@ def influxdb_get_measurement_metadata(client: InfluxDBClient, measurement: str)
 #         print(new_entry)
 
 
+# Translation tables for the characters that must be escaped in the InfluxDB line protocol
+MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+KEY_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ "})
+STRING_FIELD_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+
+@lru_cache(maxsize=None)
+def escape_line_protocol_key(key: str) -> str:
+    """
+    Escape a tag or field key for the InfluxDB line protocol. Keys are fixed per measurement, so the result is cached.
+    """
+    return key.translate(KEY_ESCAPES)
+
+
+def format_line_protocol_field(value) -> str:
+    """
+    Format a field value for the InfluxDB line protocol, quoting and escaping strings.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return f'"{value.translate(STRING_FIELD_ESCAPES)}"'
+    return str(value)
+
+
 def build_influxline_protocol_entry(measurement: str, tags: dict, fields: dict, timestamp: int) -> str:
     """
     Format the data as an InfluxDB line protocol string.
+    Fields without a value are left out, as the line protocol has no representation for null.
+    Return None if no field has a value, since a line without fields is rejected by InfluxDB.
     """
-    tag_str = ",".join([f"{key}={value}" for key, value in tags.items()])
-    field_str = ",".join([f"{key}={value}" if value is not None else f"{key}=" for key, value in fields.items()])
+    # Append all pieces to a single list and join once to avoid intermediate strings
+    parts = [measurement.translate(MEASUREMENT_ESCAPES)]
+    append = parts.append
+    for key, value in tags.items():
+        append(",")
+        append(escape_line_protocol_key(key))
+        append("=")
+        append(str(value).translate(KEY_ESCAPES))
+    separator = " "
+    for key, value in fields.items():
+        if value is None:
+            continue
+        append(separator)
+        append(escape_line_protocol_key(key))
+        append("=")
+        append(format_line_protocol_field(value))
+        separator = ","
+    if separator == " ":
+        return None
+    append(" ")
+    append(str(timestamp))
 
-    return f"{measurement},{tag_str} {field_str} {timestamp}"
+    return "".join(parts)
 
 
-def influxdb_create_newentry(client: InfluxDBClient, measurement: str, destination_id: str, threshold: int = 600) -> str:
+def influxdb_create_newentry(client: InfluxDBClient, measurement: str, destination_id: str, tag_keys: list, field_keys: list, threshold: int = 600, last_entries: dict = None) -> str:
     """
     Check the last entry in the InfluxDB database and, if the time difference is more than the threshold,
     return a new entry formatted as an InfluxDB line protocol string.
+    The tag and field keys are fetched once by the caller; last_entries caches the last entry per destination.
     """
-    # Retrieve metadata for tag and field keys
-    tag_keys, field_keys = influxdb_get_measurement_metadata(client, measurement)
-
-    # Get the last entry for the destination
-    last_entry = influxdb_get_last_entry(client, measurement, destination_id)
+    # Get the last entry for the destination, reusing the one already fetched during this pass
+    if last_entries is None:
+        last_entries = {}
+    if destination_id not in last_entries:
+        last_entries[destination_id] = influxdb_get_last_entry(client, measurement, destination_id)
+    last_entry = last_entries[destination_id]
+
+    # Nothing to carry over for a destination without history
+    if last_entry is None:
+        return None
 
     # Get current epoch time
     current_epoch = time.time()
@@ -226,34 +503,127 @@ def influxdb_create_newentry(client: InfluxDBClient, measurement: str, destinati
                 else:
                     fields[key] = None
 
-        # Build and return influx line protocol entry
+        # Build and return influx line protocol entry, None if no field has a value
         line_protocol_entry = build_influxline_protocol_entry(measurement, tags, fields, time.time_ns())
         return line_protocol_entry
     else:
         return None
 
 
-def main(job_conf_file: str, threshold: int) -> None:
+def add_online_status(condor_metrics: str) -> str:
+    """
+    Add destination_status="online" to the field set of a condor metrics line, keeping the timestamp last.
+    Lines without a timestamp are stamped with the current time so that lines written together stay distinct points.
+    """
+    fields, _, timestamp = condor_metrics.rpartition(" ")
+    if not timestamp.isdigit():
+        fields, timestamp = condor_metrics, str(time.time_ns())
+    return f'{fields},destination_status="online" {timestamp}'
+
+
+def influxdb_write_entries(client: InfluxDBClient, database: str, entries: list, batch_size: int = 5000, max_retries: int = 3) -> None:
+    """
+    Write the line protocol entries to the InfluxDB database, sending up to batch_size lines per HTTP request.
+    Server and network errors are retried up to max_retries times and then raised so the caller can keep the entries.
+    Entries rejected by InfluxDB as invalid are logged and dropped, since writing them again cannot succeed.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            client.write_points(entries, database=database, batch_size=batch_size, protocol="line")
+            return
+        except InfluxDBClientError as e:
+            print(f"InfluxDB rejected {len(entries)} entries, dropping them: {e}")
+            return
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            print(f"Error writing entries to the InfluxDB database, retrying: {e}")
+            time.sleep(2 ** attempt)
+
+
+def flush_safely(flush, batch: list) -> bool:
+    """
+    Hand the batch to flush, logging any error so that the drain thread keeps running. Return whether it succeeded.
+    """
+    try:
+        flush(batch)
+        return True
+    except Exception as e:
+        print(f"Error flushing {len(batch)} entries: {e}")
+        return False
+
+
+def drain_loop(stats_rings: list, flush, stop_event: threading.Event, flush_size: int = 500, flush_interval: float = 1.0, max_idle_sleep: float = 1.0, max_pending: int = 100000, max_retry_interval: float = 60.0) -> None:
+    """
+    Drain the per-worker stats ring buffers while the consumers are running and hand the decoded
+    entries to flush in batches of flush_size or every flush_interval seconds.
+    While the buffers stay empty the polling interval backs off up to max_idle_sleep seconds.
+    A batch that fails to flush is kept and retried with an increasing delay, up to max_retry_interval
+    seconds; beyond max_pending entries the oldest ones are dropped.
+    Stop once every worker has sent its sentinel, or when stop_event is set and the buffers are empty.
+    """
+    batch = []
+    first_entry_time = None
+    idle_sleep = 0.01
+    retry_at = 0
+    retry_interval = flush_interval
+    active_rings = list(stats_rings)
+    while active_rings:
+        idle = True
+        for stats_ring in list(active_rings):
+            payload = stats_ring.poll()
+            if payload is None:
+                continue
+            idle = False
+            if payload == STATS_SENTINEL:
+                active_rings.remove(stats_ring)
+            else:
+                batch.append(decode_stats(payload))
+                if first_entry_time is None:
+                    first_entry_time = time.monotonic()
+
+        if idle:
+            if stop_event.is_set():
+                break
+            # Never sleep past the deadline of a pending batch
+            sleep = idle_sleep
+            if batch:
+                sleep = min(sleep, max(0, max(first_entry_time + flush_interval, retry_at) - time.monotonic()))
+            time.sleep(sleep)
+            idle_sleep = min(idle_sleep * 2, max_idle_sleep)
+        else:
+            idle_sleep = 0.01
+
+        now = time.monotonic()
+        if batch and now >= retry_at and (len(batch) >= flush_size or now - first_entry_time >= flush_interval):
+            if flush_safely(flush, batch):
+                batch = []
+                first_entry_time = None
+                retry_interval = flush_interval
+            else:
+                retry_at = now + retry_interval
+                retry_interval = min(retry_interval * 2, max_retry_interval)
+                if len(batch) > max_pending:
+                    print(f"Dropping {len(batch) - max_pending} entries that could not be flushed.")
+                    del batch[:-max_pending]
+
+    if batch:
+        flush_safely(flush, batch)
+
+
+def main(job_conf_file: str, threshold: int, idle_timeout: int, dry_run: bool) -> None:
     """
     Consume messages from multiple AMQP queues in parallel and aggregate the results.
     """
-    amqp_urls = get_pulsar_runners(job_conf_file)
+    pulsar_runners = get_pulsar_runners(job_conf_file)
 
-    if not amqp_urls:
+    if not pulsar_runners:
         print("No Pulsar runners found in the job configuration file.")
         sys.exit(1)
 
-    stats_queue = Manager().Queue()
-    processes = []
-
-    # Create a process for each AMQP URL
-    for runner, amqp_url in amqp_urls.items():
-        proc = Process(target=consume_target, args=(runner, amqp_url, stats_queue))
-        proc.start()
-        processes.append(proc)
-
-    for proc in processes:
-        proc.join()
+    if len(pulsar_runners) > 1 << (8 * VHOST_INDEX.size):
+        print(f"Too many Pulsar runners: at most {1 << (8 * VHOST_INDEX.size)} are supported.")
+        sys.exit(1)
 
     # Get the InfluxDB configuration from the environment variables
     influxdb_host, influxdb_port, influxdb_username, influxdb_password, influxdb_database, influxdb_measurement = get_influxdb_conf_from_env()
@@ -261,27 +631,82 @@ def main(job_conf_file: str, threshold: int) -> None:
     # Connect to the InfluxDB database
     client = influxdb_connect(influxdb_host, influxdb_port, influxdb_username, influxdb_password, influxdb_database)
 
-    # Aggregate the results from all processes
-    results = []
-    while not stats_queue.empty():
-        body = stats_queue.get()
-        for vhost, data in body.items():
-            if data:
-                data['condor_metrics'] = f"{data['condor_metrics']},destination_status=online"
-                results.append(data['condor_metrics'])
+    if not client:
+        sys.exit(1)
+
+    # Retrieve metadata for tag and field keys once instead of for every offline vhost
+    tag_keys, field_keys = influxdb_get_measurement_metadata(client, influxdb_measurement)
+
+    # Vhosts are identified by their index in the ring buffer payloads
+    vhosts = [runner["vhost"] for runner in pulsar_runners.values()]
+
+    def flush(entries: list) -> None:
+        # Aggregate the results of one batch and push them out
+        results = []
+        last_entries = {}
+        for vhost_idx, condor_metrics in entries:
+            if condor_metrics:
+                results.append(add_online_status(condor_metrics))
             else:
-                new_entry = influxdb_create_newentry(client, influxdb_measurement, vhost, threshold)
+                try:
+                    new_entry = influxdb_create_newentry(client, influxdb_measurement, vhosts[vhost_idx], tag_keys, field_keys, threshold, last_entries)
+                except Exception as e:
+                    print(f"Error creating offline entry for {vhosts[vhost_idx]}: {e}")
+                    continue
                 if new_entry:
                     results.append(new_entry)
 
-    for result in results:
-        print(result)
+        if not results:
+            return
+
+        if dry_run:
+            # Emit all results with a single write instead of one syscall per line
+            sys.stdout.write("\n".join(results) + "\n")
+            sys.stdout.flush()
+        else:
+            influxdb_write_entries(client, influxdb_database, results)
+
+    stats_rings = []
+    processes = []
+    stop_event = threading.Event()
+    drain_thread = None
+
+    try:
+        # Create a process for each AMQP URL, each with its own single-producer ring buffer
+        for vhost_idx, runner in enumerate(pulsar_runners.values()):
+            stats_ring = SharedRingBuffer()
+            stats_rings.append(stats_ring)
+            proc = Process(target=consume_target, args=(vhost_idx, runner, stats_ring, idle_timeout))
+            proc.start()
+            processes.append(proc)
+
+        # Aggregate the results while the processes are consuming
+        drain_thread = threading.Thread(target=drain_loop, args=(stats_rings, flush, stop_event))
+        drain_thread.start()
+
+        for proc in processes:
+            proc.join()
+    finally:
+        # Stop the processes still running after an error or interrupt
+        for proc in processes:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+        # Processes that died without sending their sentinel must not keep the drain thread alive
+        stop_event.set()
+        if drain_thread is not None:
+            drain_thread.join()
+        for stats_ring in stats_rings:
+            stats_ring.close(unlink=True)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Consume messages from AMQP queues and aggregate them.")
     parser.add_argument("job_conf_file", type=str, help="Path to the job configuration file (YAML).")
     parser.add_argument("--threshold", type=int, default=600, help="Time threshold in seconds for setting destination_status=offline.")
+    parser.add_argument("--idle-timeout", type=int, default=60, help="Time in seconds without messages after which a vhost is checked for being offline.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the line protocol entries instead of writing them to InfluxDB.")
     args = parser.parse_args()
 
-    main(args.job_conf_file, args.threshold)
+    main(args.job_conf_file, args.threshold, args.idle_timeout, args.dry_run)
@@ -6,8 +6,31 @@ import re
 import subprocess
 import sys
 import time
+from urllib.parse import urlparse
 import yaml
 from kombu import Connection, Exchange, Producer, Queue
+from kombu.serialization import register
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Use the libyaml based loader when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def register_orjson_serializer() -> str:
+    """
+    Register orjson as a kombu serializer and return the serializer name to use, falling back to json if orjson is not installed.
+    """
+    if orjson is None:
+        return "json"
+    register("ojson", orjson.dumps, orjson.loads, content_type="application/json", content_encoding="binary")
+    return "ojson"
+
+
+SERIALIZER = register_orjson_serializer()
 
 
 def get_amqp_url(pulsar_app_file: str) -> None:
@@ -20,7 +43,7 @@ def get_amqp_url(pulsar_app_file: str) -> None:
         return None
 
     with open(pulsar_app_file, "r") as file:
-        app_conf = yaml.safe_load(file)
+        app_conf = yaml.load(file, Loader=YamlLoader)
         amqp_url = app_conf['message_queue_url']
 
     return amqp_url
@@ -30,17 +53,18 @@ def get_vhost_name(amqp_url: str) -> str:
     """
     Parse the AMQP URL to extract the vhost name.
     """
-    vhost = amqp_url.split("/")[-1].split("?")[0]
+    vhost = urlparse(amqp_url).path.lstrip("/")
     return vhost
 
 
 def connect_to_queue(amqp_url: str) -> Connection:
     """
-    Connect to the AMQP queue using the provided URL.
+    Connect to the AMQP queue using the provided URL with publisher confirms enabled.
     """
     # With try and except block, connect to the AMQP queue using the provided URL and manage the error if the connection fails
     try:
-        connection = Connection(amqp_url)
+        # Publisher confirms are only supported by py-amqp, so the librabbitmq transport is not used here
+        connection = Connection(amqp_url, transport_options={"confirm_publish": True})
         connection.ensure_connection(max_retries=3)
         return connection
     except Exception as e:
@@ -56,48 +80,49 @@ def process_condor_status_output(condor_status_output: str) -> str:
     return processed_output
 
 
-def get_condor_status(cluster_status_script_file: str) -> str:
+def get_condor_status(cluster_status_script_file: str, destination_id: str) -> str:
     """
-    Get condor status from shell script output
+    Get condor status from shell script output, with the destination added and stamped with the collection time
     """
     condor_metrics = process_condor_status_output(subprocess.check_output(["sh", cluster_status_script_file]).decode("utf-8").strip())
 
-    # Add timestamp
-    now = time.time()
-    condor_metrics = f"{condor_metrics},querytime={now}"
+    # Add timestamp, both as querytime field and as nanosecond point timestamp so batched samples stay distinct points
+    now_ns = time.time_ns()
+    condor_metrics = f'{condor_metrics},querytime={now_ns / 1e9},destinationd_id="{destination_id}" {now_ns}'
     return condor_metrics
 
 
-def produce_message(amqp_url: str, condor_metrics: str) -> None:
+def declare_queue(connection: Connection, vhost: str) -> tuple:
     """
-    Produce and publish messages to the queue.
+    Declare the condor exchange and queue for the vhost once and return them with the routing key.
     """
-    connection = connect_to_queue(amqp_url)
+    routing_key = f"{vhost}-condor"
+    exchange = Exchange(f"{vhost}-condor-exchange", type="direct")
+    queue = Queue(name=f"{vhost}-condor-stats", exchange=exchange, routing_key=routing_key)
+    queue.maybe_bind(connection)
+    queue.declare()
+    return exchange, queue, routing_key
 
-    if connection:
-        vhost = get_vhost_name(amqp_url)
-        routing_key = f"{vhost}-condor"
-        channel = connection.channel()
-        exchange = Exchange(f"{vhost}-condor-exchange", type="direct")
-        producer = Producer(exchange=exchange, channel=channel, routing_key=routing_key)
-        queue = Queue(name=f"{vhost}-condor-stats", exchange=exchange, routing_key=routing_key)
-        queue.maybe_bind(connection)
-        queue.declare()
-
-        # Add destination to metrics
-        condor_metrics = f"{condor_metrics},destinationd_id={vhost}"
-
-        producer.publish(
-            {"condor_metrics": condor_metrics},
-            exchange=exchange,
-            routing_key=routing_key,
-            declare=[queue],
-            serializer="json"
-        )
-        connection.release()
+
+def produce_message(producer: Producer, exchange: Exchange, queue: Queue, routing_key: str, batch: list, confirm_timeout: float = 5) -> None:
+    """
+    Publish a batch of condor metrics as a single compressed message using the long-lived producer.
+    The whole batch is confirmed by the broker at once; a nack or confirm timeout raises so the batch can be retried.
+    """
+    producer.publish(
+        {"batch": batch},
+        exchange=exchange,
+        routing_key=routing_key,
+        declare=[queue],
+        serializer=SERIALIZER,
+        compression="gzip",
+        retry=True,
+        retry_policy={"max_retries": 3},
+        confirm_timeout=confirm_timeout
+    )
 
 
-def main(pulsar_app_file: str, cluster_status_script_file: str) -> None:
+def main(pulsar_app_file: str, cluster_status_script_file: str, interval: int, batch_size: int, batch_timeout: int, max_pending: int) -> None:
 
     amqp_url = get_amqp_url(pulsar_app_file)
 
@@ -105,18 +130,60 @@ def main(pulsar_app_file: str, cluster_status_script_file: str) -> None:
         print("No Pulsar url found in the pulsar configuration file.")
         sys.exit(1)
 
-    # Get the condor status
-    condor_metrics = get_condor_status(cluster_status_script_file)
+    connection = connect_to_queue(amqp_url)
+
+    if not connection:
+        sys.exit(1)
+
+    vhost = get_vhost_name(amqp_url)
+    exchange, queue, routing_key = declare_queue(connection, vhost)
 
-    # Create and publish message
-    produce_message(amqp_url, condor_metrics)
+    # Publish on the default channel of the connection that is already open
+    producer = Producer(connection.default_channel)
+
+    # Keep the connection open, collect the condor status on every interval and publish in batches
+    batch = []
+    first_sample_time = None
+    try:
+        while True:
+            try:
+                # Get the condor status with the destination added
+                batch.append(get_condor_status(cluster_status_script_file, vhost))
+                # Drop the oldest samples if publishing keeps failing
+                if len(batch) > max_pending:
+                    print(f"Dropping {len(batch) - max_pending} unpublished condor status samples.")
+                    del batch[:-max_pending]
+                if first_sample_time is None:
+                    first_sample_time = time.monotonic()
+            except Exception as e:
+                print(f"Error collecting condor status: {e}")
+
+            if batch and (len(batch) >= batch_size or time.monotonic() - first_sample_time >= batch_timeout):
+                try:
+                    produce_message(producer, exchange, queue, routing_key, batch)
+                    batch = []
+                    first_sample_time = None
+                except Exception as e:
+                    print(f"Error publishing condor status: {e}")
+            time.sleep(interval)
+    finally:
+        # Best-effort publish of the samples still pending on shutdown
+        if batch:
+            try:
+                produce_message(producer, exchange, queue, routing_key, batch)
+            except Exception as e:
+                print(f"Error publishing {len(batch)} pending condor status samples on shutdown: {e}")
+        connection.release()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Produce messages to AMQP queues.")
     parser.add_argument("pulsar_app_file", type=str, help="Path to the Pulsar app configuration file (YAML).")
     parser.add_argument("cluster_status_script_file", type=str, help="Path to the shell script that produces influx compatible condor status metrics.")
+    parser.add_argument("--interval", type=int, default=60, help="Time in seconds between two condor status collections.")
+    parser.add_argument("--batch-size", type=int, default=10, help="Number of condor status samples to publish in a single message.")
+    parser.add_argument("--batch-timeout", type=int, default=300, help="Maximum time in seconds a sample may wait in the batch before it is published.")
+    parser.add_argument("--max-pending", type=int, default=1000, help="Maximum number of unpublished samples kept while the broker is unreachable; the oldest are dropped first.")
     args = parser.parse_args()
 
-    main(args.pulsar_app_file, args.cluster_status_script_file)
-
+    main(args.pulsar_app_file, args.cluster_status_script_file, args.interval, args.batch_size, args.batch_timeout, args.max_pending)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The consumer and producer are standalone scripts, make them importable as modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "consumer"))
+sys.path.insert(0, os.path.join(ROOT, "producer"))
@@ -0,0 +1,63 @@
+import pytest
+
+import producer
+
+
+class FakeConnection:
+    default_channel = None
+
+    def __init__(self):
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """
+    Run producer.main against fake AMQP and condor helpers and record the published batches.
+    """
+    batches = []
+    connection = FakeConnection()
+    samples = iter(f"sample{n}" for n in range(100))
+    monkeypatch.setattr(producer, "get_amqp_url", lambda pulsar_app_file: "amqp://guest@localhost/galaxy")
+    monkeypatch.setattr(producer, "connect_to_queue", lambda amqp_url: connection)
+    monkeypatch.setattr(producer, "declare_queue", lambda connection, vhost: ("exchange", "queue", "routing_key"))
+    monkeypatch.setattr(producer, "Producer", lambda channel: "producer")
+    monkeypatch.setattr(producer, "get_condor_status", lambda script, vhost: next(samples))
+    failures = []
+
+    def produce_message(producer, exchange, queue, routing_key, batch):
+        if failures and failures.pop():
+            raise ConnectionError("broker unavailable")
+        batches.append(list(batch))
+    monkeypatch.setattr(producer, "produce_message", produce_message)
+
+    def run(iterations, failed_publishes=0, **kwargs):
+        failures.extend([True] * failed_publishes)
+        sleeps = iter(range(iterations - 1))
+
+        def sleep(interval):
+            if next(sleeps, None) is None:
+                raise KeyboardInterrupt
+        monkeypatch.setattr(producer.time, "sleep", sleep)
+
+        options = {"interval": 60, "batch_size": 2, "batch_timeout": 300, "max_pending": 1000}
+        options.update(kwargs)
+        with pytest.raises(KeyboardInterrupt):
+            producer.main("app.yml", "condor.sh", **options)
+        assert connection.released
+        return batches
+
+    return run
+
+
+def test_main_publishes_full_batches_and_pending_samples_on_exit(published):
+    assert published(5) == [["sample0", "sample1"], ["sample2", "sample3"], ["sample4"]]
+
+
+def test_main_keeps_only_max_pending_samples_while_publishing_fails(published, capsys):
+    # Every publish in the loop fails, the exit flush gets through with the newest samples only
+    assert published(6, failed_publishes=5, max_pending=3) == [["sample3", "sample4", "sample5"]]
+    assert "Dropping 1 unpublished condor status samples." in capsys.readouterr().out